@@ -5,172 +5,621 @@ Provides proper PDF text extraction for the CIPP Analyzer application
 """
 
 import sys
+import re
 import json
 import logging
 from pathlib import Path
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import multiprocessing
+import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import base64
-import tempfile
 import os
 
+# Prefer pybase64 (SIMD-accelerated libbase64) for decoding uploads
+try:
+    import pybase64 as b64
+except ImportError:
+    b64 = base64
+
+# Prefer orjson for parsing requests and serializing the extracted text
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Standard base64 alphabet (padding excluded), used to validate uploads before decoding
+B64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+# ASCII whitespace stripped from uploads so line-wrapped base64 (RFC 2045) is accepted
+B64_WHITESPACE = b' \t\n\r\x0b\x0c'
+
+# Precompiled patterns used by clean_extracted_text
+_INLINE_WS = re.compile(r'[^\S\n]+')
+_LEADING_TRAILING_WS = re.compile(r'(?m)^ | $')
+_BLANK_LINES = re.compile(r'\n{2,}')
+
+# Default limits on the size of PDF accepted and text returned (overridable per request)
+MAX_PAGES_DEFAULT = 200
+MAX_CHARS_DEFAULT = 2 * 1024 * 1024
+
+# Page-parallel extraction for the native backends. PDFium and MuPDF are not
+# thread-safe, so large documents are split into page ranges across worker
+# processes, each opening its own copy of the PDF.
+PARALLEL_MIN_PAGES = 16
+MAX_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+# Serializes PDFium/MuPDF calls made in this process, since waitress serves
+# requests from several threads and neither library may be called concurrently
+_native_pdf_lock = threading.Lock()
+
+# LRU cache of cleaned text for recently uploaded PDFs, keyed by SHA-256 of the bytes
+TEXT_CACHE_SIZE = 64
+_text_cache = OrderedDict()
+_text_cache_lock = threading.Lock()
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+app.json.sort_keys = False  # Skip key sorting when serializing responses
 
 # Try to import PDF processing libraries
 try:
-    import PyPDF2
-    PDF_LIBRARY = "PyPDF2"
-    logger.info("Using PyPDF2 for PDF processing")
+    import pypdfium2
+    PDF_LIBRARY = "pypdfium2"
+    logger.info("Using pypdfium2 for PDF processing")
 except ImportError:
     try:
-        import pdfplumber
-        PDF_LIBRARY = "pdfplumber"
-        logger.info("Using pdfplumber for PDF processing")
+        import fitz
+        PDF_LIBRARY = "PyMuPDF"
+        logger.info("Using PyMuPDF for PDF processing")
     except ImportError:
         try:
-            from pdfminer.high_level import extract_text
-            PDF_LIBRARY = "pdfminer"
-            logger.info("Using pdfminer for PDF processing")
+            import PyPDF2
+            PDF_LIBRARY = "PyPDF2"
+            logger.info("Using PyPDF2 for PDF processing")
         except ImportError:
-            PDF_LIBRARY = None
-            logger.error("No PDF processing library found. Please install: pip install PyPDF2 pdfplumber pdfminer.six")
+            try:
+                import pdfplumber
+                PDF_LIBRARY = "pdfplumber"
+                logger.info("Using pdfplumber for PDF processing")
+            except ImportError:
+                try:
+                    from pdfminer.high_level import extract_text
+                    PDF_LIBRARY = "pdfminer"
+                    logger.info("Using pdfminer for PDF processing")
+                except ImportError:
+                    PDF_LIBRARY = None
+                    logger.error("No PDF processing library found. Please install: pip install pypdfium2 PyMuPDF PyPDF2 pdfplumber pdfminer.six")
 
-def extract_text_pypdf2(pdf_path):
-    """Extract text using PyPDF2"""
-    text = ""
+def check_import(module_name):
+    """Check if a module can be imported"""
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text.strip():
-                    text += f"\n--- PAGE {page_num + 1} ---\n{page_text}\n"
+        __import__(module_name)
+        return True
+    except ImportError:
+        return False
 
-        logger.info(f"PyPDF2 extracted {len(text)} characters from {len(pdf_reader.pages)} pages")
-        return text.strip()
+# Which PDF libraries can be imported, checked once at startup
+LIBRARIES_AVAILABLE = {
+    'pypdfium2': check_import('pypdfium2'),
+    'PyMuPDF': check_import('fitz'),
+    'PyPDF2': check_import('PyPDF2'),
+    'pdfplumber': check_import('pdfplumber'),
+    'pdfminer': check_import('pdfminer.high_level')
+}
+
+class PdfTooLargeError(Exception):
+    """Raised when a PDF has more pages than the caller allows"""
+
+    def __init__(self, page_count, max_pages):
+        super().__init__(f"PDF too large: {page_count} pages (limit {max_pages})")
+        self.page_count = page_count
+        self.max_pages = max_pages
+
+def check_page_count(page_count, max_pages):
+    """Raise PdfTooLargeError if a document has more pages than allowed"""
+    if max_pages and page_count > max_pages:
+        raise PdfTooLargeError(page_count, max_pages)
+
+def as_pdf_file(pdf_source):
+    """Wrap in-memory PDF bytes in a file-like object; paths are returned unchanged"""
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return BytesIO(pdf_source)
+    return pdf_source
+
+def take_page_texts(page_texts, max_chars=None):
+    """Collect page texts from an iterable, stopping once more than max_chars have been read
+
+    Blank pages are not counted, matching join_page_texts.
+    """
+    taken = []
+    total_chars = 0
+    for page_text in page_texts:
+        taken.append(page_text)
+        if page_text.strip():
+            total_chars += len(page_text)
+        if max_chars and total_chars > max_chars:
+            break
+    return taken
+
+def log_truncation(max_chars, page_num, page_count):
+    """Log that max_chars stopped extraction before the last page"""
+    logger.warning(f"Character limit of {max_chars} reached after page {page_num + 1} of {page_count}, text truncated")
+
+def join_page_texts(page_texts, page_count, max_chars=None):
+    """Join page texts under page headers, skipping blank pages and stopping past max_chars
+
+    Returns the text and whether pages were left out because of max_chars.
+    """
+    parts = []
+    total_chars = 0
+    for page_num, page_text in enumerate(page_texts):
+        if page_text.strip():
+            parts.append(f"\n--- PAGE {page_num + 1} ---\n")
+            parts.append(page_text)
+            parts.append("\n")
+            total_chars += len(page_text)
+        if max_chars and total_chars > max_chars and page_num + 1 < page_count:
+            log_truncation(max_chars, page_num, page_count)
+            return "".join(parts), True
+    return "".join(parts), False
+
+def get_extract_pool():
+    """Return the shared worker process pool, creating it on first use"""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # The pool is created from a request thread, and forking a multithreaded
+            # process is unsafe, so workers are always spawned fresh
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=MAX_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _extract_pool
+
+def reset_extract_pool(pool):
+    """Discard a broken worker pool so the next large document starts a fresh one"""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def extract_page_range(open_func, page_texts_func, pdf_source, start, stop, max_chars=None):
+    """Open the PDF in a worker process and extract the text of pages [start, stop)"""
+    doc = open_func(pdf_source)
+    try:
+        return page_texts_func(doc, start, stop, max_chars)
+    finally:
+        doc.close()
+
+def extract_page_texts(open_func, page_texts_func, doc, pdf_source, page_count, max_chars=None):
+    """Extract the text of every page in order, in parallel for large documents
+
+    Small documents are read from the already open doc; large ones are split into
+    page ranges that worker processes reopen from pdf_source with open_func.
+    """
+    if page_count < PARALLEL_MIN_PAGES or MAX_EXTRACT_WORKERS < 2:
+        return page_texts_func(doc, 0, page_count, max_chars)
+
+    pool = get_extract_pool()
+    step = -(-page_count // MAX_EXTRACT_WORKERS)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    try:
+        futures = [
+            pool.submit(extract_page_range, open_func, page_texts_func, pdf_source, start, stop, max_chars)
+            for start, stop in ranges
+        ]
+
+        page_texts = []
+        for (start, stop), future in zip(ranges, futures):
+            range_texts = future.result()
+            page_texts.extend(range_texts)
+            if len(range_texts) < stop - start:
+                # This range stopped at max_chars; later ranges would leave a gap in the page numbering
+                for later in futures:
+                    later.cancel()
+                break
+        return page_texts
+    except BrokenProcessPool as e:
+        # A worker died (native crash, OOM kill); replace the pool and finish in this process
+        logger.warning(f"Extraction worker pool broke, extracting serially: {e}")
+        reset_extract_pool(pool)
+        return page_texts_func(doc, 0, page_count, max_chars)
+
+def open_pypdfium2(pdf_source):
+    """Open a PDF path or PDF bytes with pypdfium2"""
+    import pypdfium2 as pdfium
+    return pdfium.PdfDocument(pdf_source)
+
+def pypdfium2_page_text(pdf, page_num):
+    """Extract the text of one page of an open pypdfium2 document"""
+    page = pdf[page_num]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
+
+def pypdfium2_page_texts(pdf, start, stop, max_chars=None):
+    """Extract the text of pages [start, stop) of an open pypdfium2 document, stopping past max_chars"""
+    return take_page_texts((pypdfium2_page_text(pdf, page_num) for page_num in range(start, stop)), max_chars)
+
+def extract_text_pypdfium2(pdf_source, max_pages=None, max_chars=None):
+    """Extract text using pypdfium2 (PDFium engine, fastest)"""
+    try:
+        with _native_pdf_lock:
+            pdf = open_pypdfium2(pdf_source)
+            try:
+                page_count = len(pdf)
+                check_page_count(page_count, max_pages)
+                page_texts = extract_page_texts(open_pypdfium2, pypdfium2_page_texts, pdf, pdf_source, page_count, max_chars)
+            finally:
+                pdf.close()
+
+        text, truncated = join_page_texts(page_texts, page_count, max_chars)
+        logger.info(f"pypdfium2 extracted {len(text)} characters from {page_count} pages")
+        return text.strip(), truncated
+    except PdfTooLargeError:
+        raise
+    except Exception as e:
+        logger.error(f"pypdfium2 extraction failed: {e}")
+        raise
+
+def open_pymupdf(pdf_source):
+    """Open a PDF path or PDF bytes with PyMuPDF"""
+    import fitz
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source)
+
+def pymupdf_page_texts(doc, start, stop, max_chars=None):
+    """Extract the text of pages [start, stop) of an open PyMuPDF document, stopping past max_chars"""
+    return take_page_texts((doc.load_page(page_num).get_text("text") for page_num in range(start, stop)), max_chars)
+
+def extract_text_pymupdf(pdf_source, max_pages=None, max_chars=None):
+    """Extract text using PyMuPDF (MuPDF engine)"""
+    try:
+        with _native_pdf_lock:
+            doc = open_pymupdf(pdf_source)
+            try:
+                page_count = doc.page_count
+                check_page_count(page_count, max_pages)
+                page_texts = extract_page_texts(open_pymupdf, pymupdf_page_texts, doc, pdf_source, page_count, max_chars)
+            finally:
+                doc.close()
+
+        text, truncated = join_page_texts(page_texts, page_count, max_chars)
+        logger.info(f"PyMuPDF extracted {len(text)} characters from {page_count} pages")
+        return text.strip(), truncated
+    except PdfTooLargeError:
+        raise
+    except Exception as e:
+        logger.error(f"PyMuPDF extraction failed: {e}")
+        raise
+
+def extract_text_pypdf2(pdf_source, max_pages=None, max_chars=None):
+    """Extract text using PyPDF2"""
+    try:
+        import PyPDF2
+        pdf_reader = PyPDF2.PdfReader(as_pdf_file(pdf_source))
+        page_count = len(pdf_reader.pages)
+        check_page_count(page_count, max_pages)
+        # Pages are extracted lazily so nothing past max_chars is read
+        text, truncated = join_page_texts((page.extract_text() for page in pdf_reader.pages), page_count, max_chars)
+        logger.info(f"PyPDF2 extracted {len(text)} characters from {page_count} pages")
+        return text.strip(), truncated
+    except PdfTooLargeError:
+        raise
     except Exception as e:
         logger.error(f"PyPDF2 extraction failed: {e}")
         raise
 
-def extract_text_pdfplumber(pdf_path):
+def extract_text_pdfplumber(pdf_source, max_pages=None, max_chars=None):
     """Extract text using pdfplumber (better for tables and layout)"""
-    text = ""
+    parts = []
+    truncated = False
     try:
         import pdfplumber
-        with pdfplumber.open(pdf_path) as pdf:
+        with pdfplumber.open(as_pdf_file(pdf_source)) as pdf:
+            page_count = len(pdf.pages)
+            check_page_count(page_count, max_pages)
+            total_chars = 0
             for page_num, page in enumerate(pdf.pages):
                 page_text = page.extract_text()
                 if page_text and page_text.strip():
-                    text += f"\n--- PAGE {page_num + 1} ---\n{page_text}\n"
-
-                # Also try to extract tables
-                tables = page.extract_tables()
+                    parts.append(f"\n--- PAGE {page_num + 1} ---\n")
+                    parts.append(page_text)
+                    parts.append("\n")
+                    total_chars += len(page_text)
+
+                # Also try to extract tables, skipping pages without enough ruling edges to draw one
+                if len(page.edges) < 4:
+                    tables = []
+                else:
+                    tables = page.extract_tables()
                 if tables:
-                    text += f"\n--- TABLES ON PAGE {page_num + 1} ---\n"
+                    parts.append(f"\n--- TABLES ON PAGE {page_num + 1} ---\n")
                     for table_num, table in enumerate(tables):
-                        text += f"\nTable {table_num + 1}:\n"
+                        parts.append(f"\nTable {table_num + 1}:\n")
                         for row in table:
                             if row:
-                                row_text = " | ".join([cell or "" for cell in row])
-                                text += f"{row_text}\n"
-
-        logger.info(f"pdfplumber extracted {len(text)} characters from {len(pdf.pages)} pages")
-        return text.strip()
+                                row_text = " | ".join(cell or "" for cell in row)
+                                parts.append(row_text)
+                                parts.append("\n")
+                                total_chars += len(row_text)
+
+                if max_chars and total_chars > max_chars and page_num + 1 < page_count:
+                    log_truncation(max_chars, page_num, page_count)
+                    truncated = True
+                    break
+
+        text = "".join(parts)
+        logger.info(f"pdfplumber extracted {len(text)} characters from {page_count} pages")
+        return text.strip(), truncated
+    except PdfTooLargeError:
+        raise
     except Exception as e:
         logger.error(f"pdfplumber extraction failed: {e}")
         raise
 
-def extract_text_pdfminer(pdf_path):
-    """Extract text using pdfminer"""
+def extract_text_pdfminer(pdf_source, max_pages=None, max_chars=None):
+    """Extract text using pdfminer
+
+    pdfminer extracts the whole document in one call without reporting its page
+    count, so it reads at most max_pages pages instead of rejecting larger PDFs,
+    and max_chars is not applied. Such cuts cannot be detected, so the text is
+    never reported as truncated.
+    """
     try:
         from pdfminer.high_level import extract_text
-        text = extract_text(pdf_path)
+        text = extract_text(as_pdf_file(pdf_source), maxpages=max_pages or 0)
         logger.info(f"pdfminer extracted {len(text)} characters")
-        return text.strip()
+        return text.strip(), False
     except Exception as e:
         logger.error(f"pdfminer extraction failed: {e}")
         raise
 
-def extract_pdf_text(pdf_path):
-    """Extract text from PDF using the best available method"""
+# Extraction function for each backend PDF_LIBRARY can select
+PDF_EXTRACTORS = {
+    "pypdfium2": extract_text_pypdfium2,
+    "PyMuPDF": extract_text_pymupdf,
+    "PyPDF2": extract_text_pypdf2,
+    "pdfplumber": extract_text_pdfplumber,
+    "pdfminer": extract_text_pdfminer,
+}
+
+def extract_pdf_text(pdf_source, max_pages=None, max_chars=None):
+    """Extract text from a PDF path or PDF bytes using the best available method
+
+    Raises PdfTooLargeError when the PDF has more than max_pages pages (checked by
+    the backend on the document it opens, before any text is extracted); extraction
+    stops once roughly max_chars characters have been collected. Returns the text
+    and whether later pages were left out because of max_chars.
+    """
     if not PDF_LIBRARY:
-        raise Exception("No PDF processing library available. Please install: pip install PyPDF2 pdfplumber pdfminer.six")
+        raise Exception("No PDF processing library available. Please install: pip install pypdfium2 PyMuPDF PyPDF2 pdfplumber pdfminer.six")
+
+    if isinstance(pdf_source, (bytes, bytearray)):
+        logger.info(f"Extracting text from {len(pdf_source)} byte PDF")
+    else:
+        logger.info(f"Extracting text from: {pdf_source}")
 
-    logger.info(f"Extracting text from: {pdf_path}")
+    # Parse once with the selected backend; only a pypdfium2 error falls back to PyMuPDF
+    method = PDF_EXTRACTORS[PDF_LIBRARY]
+    try:
+        text, truncated = method(pdf_source, max_pages, max_chars)
+    except PdfTooLargeError:
+        raise
+    except Exception as e:
+        if PDF_LIBRARY != "pypdfium2" or not LIBRARIES_AVAILABLE['PyMuPDF']:
+            raise
+        logger.warning(f"Method {method.__name__} failed, retrying with PyMuPDF: {e}")
+        method = extract_text_pymupdf
+        text, truncated = method(pdf_source, max_pages, max_chars)
+
+    logger.info(f"Successfully extracted text using {method.__name__}")
+    return text, truncated
+
+def is_valid_base64(b64_data):
+    """Check the length, padding and alphabet of whitespace-free base64 bytes without decoding them"""
+    if len(b64_data) % 4:
+        return False
 
-    # Try different extraction methods in order of preference
-    methods = []
-    if PDF_LIBRARY == "pdfplumber":
-        methods = [extract_text_pdfplumber, extract_text_pypdf2, extract_text_pdfminer]
-    elif PDF_LIBRARY == "PyPDF2":
-        methods = [extract_text_pypdf2, extract_text_pdfplumber, extract_text_pdfminer]
-    else:  # pdfminer
-        methods = [extract_text_pdfminer, extract_text_pdfplumber, extract_text_pypdf2]
+    tail = b64_data[-4:]
+    padding = len(tail) - len(tail.rstrip(b'='))
+    if padding > 2:
+        return False
 
-    last_error = None
-    for method in methods:
+    # translate() deletes every alphabet byte in one C-level pass; only the padding may remain
+    return b64_data.translate(None, B64_ALPHABET) == b'=' * padding
+
+def decode_pdf_base64(pdf_b64):
+    """Validate and decode base64 PDF bytes, raising ValueError if they are empty or malformed"""
+    pdf_b64 = pdf_b64.translate(None, B64_WHITESPACE)
+    if not pdf_b64:
+        raise ValueError('no data')
+    if not is_valid_base64(pdf_b64):
+        raise ValueError('expected A-Z, a-z, 0-9, +, / with = padding and a length that is a multiple of 4')
+
+    # Hand the buffer to the decoder without copying it
+    return b64.b64decode(memoryview(pdf_b64))
+
+def get_cached_text(key):
+    """Return cached (text, truncated) for a PDF digest, or None if it has not been seen recently"""
+    with _text_cache_lock:
+        entry = _text_cache.get(key)
+        if entry is not None:
+            _text_cache.move_to_end(key)
+        return entry
+
+def cache_text(key, text, truncated):
+    """Store cleaned text for a PDF digest, evicting the least recently used entry"""
+    with _text_cache_lock:
+        _text_cache[key] = (text, truncated)
+        _text_cache.move_to_end(key)
+        while len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+
+def parse_json_body():
+    """Parse the raw request body as JSON, using orjson when available"""
+    body = request.get_data(cache=False)
+    if orjson is None:
+        return json.loads(body)
+    return orjson.loads(body)
+
+def json_response(payload):
+    """Build a JSON response, serializing with orjson when available"""
+    if orjson is None:
+        return jsonify(payload)
+    return app.response_class(orjson.dumps(payload), mimetype='application/json')
+
+def parse_limit(value):
+    """Convert a limit from JSON or a query string to int, raising ValueError unless it is a whole number"""
+    # int() would quietly turn true into 1 and 1.9 into 1
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    return int(value)
+
+def parse_extract_limits(options):
+    """Read max_pages/max_chars from request options, raising ValueError if they are invalid"""
+    try:
+        max_pages = parse_limit(options.get('max_pages', MAX_PAGES_DEFAULT))
+        max_chars = parse_limit(options.get('max_chars', MAX_CHARS_DEFAULT))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('max_pages and max_chars must be integers')
+
+    if max_pages < 1 or max_chars < 1:
+        raise ValueError('max_pages and max_chars must be positive')
+    return max_pages, max_chars
+
+def extract_text_response(pdf_bytes, max_pages=MAX_PAGES_DEFAULT, max_chars=MAX_CHARS_DEFAULT, **extra):
+    """Extract and clean the text of an uploaded PDF and build the JSON response"""
+    # Skip parsing entirely for PDFs we have already extracted with the same limits
+    cache_key = (hashlib.sha256(pdf_bytes).digest(), max_pages, max_chars)
+    cached = get_cached_text(cache_key)
+
+    if cached is not None:
+        cleaned_text, truncated = cached
+        logger.info(f"Returning {len(cleaned_text)} cached characters")
+    else:
+        # Extract text
         try:
-            text = method(pdf_path)
-            if text and len(text.strip()) > 50:  # Minimum reasonable text length
-                logger.info(f"Successfully extracted text using {method.__name__}")
-                return text
-        except Exception as e:
-            last_error = e
-            logger.warning(f"Method {method.__name__} failed: {e}")
-            continue
-
-    raise Exception(f"All PDF extraction methods failed. Last error: {last_error}")
+            extracted_text, truncated = extract_pdf_text(pdf_bytes, max_pages, max_chars)
+        except PdfTooLargeError as e:
+            return jsonify({'error': str(e), 'pages': e.page_count, 'max_pages': e.max_pages}), 413
+
+        if not extracted_text or len(extracted_text.strip()) < 10:
+            return jsonify({'error': 'No readable text found in PDF'}), 400
+
+        # Clean up the text
+        cleaned_text = clean_extracted_text(extracted_text)
+        cache_text(cache_key, cleaned_text, truncated)
+
+        logger.info(f"Successfully extracted {len(cleaned_text)} characters")
+
+    return json_response({
+        'success': True,
+        'text': cleaned_text,
+        'length': len(cleaned_text),
+        'truncated': truncated,
+        'method': PDF_LIBRARY,
+        **extra
+    })
 
 @app.route('/extract_pdf', methods=['POST'])
 def extract_pdf_endpoint():
-    """API endpoint to extract text from PDF"""
+    """API endpoint to extract text from a base64-encoded PDF in a JSON body (deprecated)"""
     try:
-        data = request.get_json()
+        try:
+            data = parse_json_body()
+        except ValueError as e:
+            return jsonify({'error': f'Invalid JSON body: {e}'}), 400
 
-        if not data or 'pdf_data' not in data:
+        if not isinstance(data, dict) or 'pdf_data' not in data:
             return jsonify({'error': 'No PDF data provided'}), 400
 
-        # Decode base64 PDF data
+        pdf_b64 = data['pdf_data']
+        if not pdf_b64:
+            return jsonify({'error': 'No PDF data provided'}), 400
+        if not isinstance(pdf_b64, str) or not pdf_b64.isascii():
+            return jsonify({'error': 'Invalid base64 data: pdf_data must be an ASCII base64 string'}), 400
+
+        # Decode base64 PDF data in memory
         try:
-            pdf_bytes = base64.b64decode(data['pdf_data'])
-        except Exception as e:
+            pdf_bytes = decode_pdf_base64(pdf_b64.encode('ascii'))
+        except ValueError as e:
             return jsonify({'error': f'Invalid base64 data: {e}'}), 400
 
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-            temp_file.write(pdf_bytes)
-            temp_path = temp_file.name
+        try:
+            max_pages, max_chars = parse_extract_limits(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return extract_text_response(
+            pdf_bytes,
+            max_pages,
+            max_chars,
+            deprecated='Base64 uploads are deprecated; POST the PDF bytes to /extract_pdf_raw with Content-Type: application/pdf'
+        )
+
+    except Exception as e:
+        logger.error(f"PDF extraction error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/extract_pdf_raw', methods=['POST'])
+def extract_pdf_raw_endpoint():
+    """API endpoint to extract text from a raw PDF body (Content-Type: application/pdf)"""
+    try:
+        pdf_bytes = request.get_data(cache=False)
+
+        if not pdf_bytes:
+            return jsonify({'error': 'No PDF data provided'}), 400
 
         try:
-            # Extract text
-            extracted_text = extract_pdf_text(temp_path)
+            max_pages, max_chars = parse_extract_limits(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return extract_text_response(pdf_bytes, max_pages, max_chars)
+
+    except Exception as e:
+        logger.error(f"PDF extraction error: {e}")
+        return jsonify({'error': str(e)}), 500
 
-            if not extracted_text or len(extracted_text.strip()) < 10:
-                return jsonify({'error': 'No readable text found in PDF'}), 400
+@app.route('/extract_pdf_base64', methods=['POST'])
+def extract_pdf_base64_endpoint():
+    """API endpoint to extract text from a base64 PDF body (Content-Type: application/base64)"""
+    try:
+        # The body is the bare base64 text, so it is decoded without a JSON round-trip
+        pdf_b64 = request.get_data(cache=False)
 
-            # Clean up the text
-            cleaned_text = clean_extracted_text(extracted_text)
+        if not pdf_b64:
+            return jsonify({'error': 'No PDF data provided'}), 400
 
-            logger.info(f"Successfully extracted {len(cleaned_text)} characters")
+        try:
+            pdf_bytes = decode_pdf_base64(pdf_b64)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid base64 data: {e}'}), 400
 
-            return jsonify({
-                'success': True,
-                'text': cleaned_text,
-                'length': len(cleaned_text),
-                'method': PDF_LIBRARY
-            })
+        try:
+            max_pages, max_chars = parse_extract_limits(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+        return extract_text_response(pdf_bytes, max_pages, max_chars)
 
     except Exception as e:
         logger.error(f"PDF extraction error: {e}")
@@ -181,19 +630,12 @@ def clean_extracted_text(text):
     if not text:
         return ""
 
-    # Remove excessive whitespace
-    lines = []
-    for line in text.split('\n'):
-        cleaned_line = ' '.join(line.split())  # Remove extra spaces
-        if cleaned_line:  # Only keep non-empty lines
-            lines.append(cleaned_line)
+    # Collapse runs of whitespace (other than newlines) on each line, trim line ends
+    cleaned = _INLINE_WS.sub(' ', text)
+    cleaned = _LEADING_TRAILING_WS.sub('', cleaned)
 
-    # Join lines with single newlines
-    cleaned = '\n'.join(lines)
-
-    # Remove excessive newlines (more than 2 consecutive)
-    import re
-    cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
+    # Drop empty lines so lines are joined with single newlines
+    cleaned = _BLANK_LINES.sub('\n', cleaned)
 
     return cleaned.strip()
 
@@ -203,25 +645,21 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'pdf_library': PDF_LIBRARY,
-        'libraries_available': {
-            'PyPDF2': 'PyPDF2' in sys.modules or check_import('PyPDF2'),
-            'pdfplumber': 'pdfplumber' in sys.modules or check_import('pdfplumber'),
-            'pdfminer': check_import('pdfminer.high_level')
-        }
+        'endpoints': {
+            '/extract_pdf_raw': 'POST raw PDF bytes (Content-Type: application/pdf), optional ?max_pages=&max_chars=',
+            '/extract_pdf_base64': 'POST base64 PDF text (Content-Type: application/base64), optional ?max_pages=&max_chars=',
+            '/extract_pdf': 'POST JSON {"pdf_data": <base64>, "max_pages": <int>, "max_chars": <int>} (deprecated)'
+        },
+        'limits': {'max_pages': MAX_PAGES_DEFAULT, 'max_chars': MAX_CHARS_DEFAULT},
+        'libraries_available': LIBRARIES_AVAILABLE
     })
 
-def check_import(module_name):
-    """Check if a module can be imported"""
-    try:
-        __import__(module_name)
-        return True
-    except ImportError:
-        return False
-
 if __name__ == '__main__':
     if not PDF_LIBRARY:
         print("ERROR: No PDF processing library found!")
         print("Please install one of the following:")
+        print("  pip install pypdfium2")
+        print("  pip install PyMuPDF")
         print("  pip install PyPDF2")
         print("  pip install pdfplumber")
         print("  pip install pdfminer.six")
@@ -231,4 +669,16 @@ if __name__ == '__main__':
     print("Service will be available at: http://localhost:5000")
     print("Health check: http://localhost:5000/health")
 
-    app.run(host='localhost', port=5000, debug=False)
\ No newline at end of file
+    # Set PDF_EXTRACTOR_DEV=1 to use Flask's development server instead of waitress.
+    # On Linux the app can also be served with multiple processes, e.g.:
+    #   gunicorn -w $(nproc) -k gthread --threads 4 -b localhost:5000 pdf_extractor:app
+    if os.environ.get('PDF_EXTRACTOR_DEV'):
+        app.run(host='localhost', port=5000, debug=False)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitress not installed, falling back to Flask's development server (pip install waitress)")
+            app.run(host='localhost', port=5000, debug=False, threaded=True)
+        else:
+            serve(app, host='localhost', port=5000, threads=(os.cpu_count() or 1) * 4)
\ No newline at end of file